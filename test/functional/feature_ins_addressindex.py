@@ -8,12 +8,28 @@
 # Test addressindex generation and fetching
 #
 
+import time
+from operator import itemgetter
+
 from test_framework.test_particl import ParticlTestFramework, bytes_to_wif
 from test_framework.util import assert_equal
 from test_framework.script import taproot_construct
 from test_framework.key import generate_privkey, compute_xonly_pubkey
 from test_framework.segwit_addr import encode_segwit_address
 
+# Addresses derived from the fixed mnemonics imported in run_test
+MS1 = 'r8L81gLiWg46j5EGfZSp2JHmA9hBgLbHuf'  # rFHaEuXkYpNUYpMMY3kMkDdayQxpc7ozti
+ADDR1 = 'pqZDE7YNWv5PJWidiaEG8tqfebkd6PNZDV'  # pcX1WHotKuQwFypDf1ZkJrh81J1DS7DfXd
+ADDR2 = 'pqavEUgLCZeGh8o9sTcCfYVAsrTgnQTUsK'
+
+
+def batch_results(node, requests):
+    # Send several RPCs in one JSON-RPC batch, results are in request order
+    responses = node.batch(requests)
+    for response in responses:
+        assert_equal(response.get('error'), None)
+    return [response['result'] for response in responses]
+
 
 class AddressIndexTest(ParticlTestFramework):
     def set_test_params(self):
@@ -57,12 +73,12 @@ class AddressIndexTest(ParticlTestFramework):
         addrs = [nodes[1].getnewaddress() for i in range(3)]
 
         ms1 = nodes[1].addmultisigaddress_part(2, addrs)['address']
-        assert (ms1 == 'r8L81gLiWg46j5EGfZSp2JHmA9hBgLbHuf')  # rFHaEuXkYpNUYpMMY3kMkDdayQxpc7ozti
+        assert (ms1 == MS1)
 
         addr1 = nodes[2].getnewaddress()
-        assert (addr1 == 'pqZDE7YNWv5PJWidiaEG8tqfebkd6PNZDV')  # pcX1WHotKuQwFypDf1ZkJrh81J1DS7DfXd
+        assert (addr1 == ADDR1)
         addr2 = nodes[3].getnewaddress()
-        assert (addr2 == 'pqavEUgLCZeGh8o9sTcCfYVAsrTgnQTUsK')
+        assert (addr2 == ADDR2)
 
         self.sync_all()
         chain_height = nodes[1].getblockcount()
@@ -71,43 +87,41 @@ class AddressIndexTest(ParticlTestFramework):
         assert_equal(nodes[1].getbalance(), 0)
         assert_equal(nodes[2].getbalance(), 0)
 
-        balance0 = nodes[1].getaddressbalance("r8L81gLiWg46j5EGfZSp2JHmA9hBgLbHuf")
+        balance0 = nodes[1].getaddressbalance(MS1)
         assert_equal(balance0["balance"], 0)
 
         # Check p2pkh and p2sh address indexes
         self.log.info("Testing p2pkh and p2sh address index...")
 
-        txid0 = nodes[0].sendtoaddress("pqZDE7YNWv5PJWidiaEG8tqfebkd6PNZDV", 10)
+        # Each tx must be mined in its own block, the height range queries,
+        # utxo heights and txid ordering checked below depend on it.
+        # Intermediate stakes skip the sync to keep the ladder cheap.
+        txid0 = nodes[0].sendtoaddress(ADDR1, 10)
         self.stakeToHeight(1, fSync=False)
-        txidb0 = nodes[0].sendtoaddress("r8L81gLiWg46j5EGfZSp2JHmA9hBgLbHuf", 10)
+        txidb0 = nodes[0].sendtoaddress(MS1, 10)
         self.stakeToHeight(2, fSync=False)
-        txid1 = nodes[0].sendtoaddress("pqZDE7YNWv5PJWidiaEG8tqfebkd6PNZDV", 15)
+        txid1 = nodes[0].sendtoaddress(ADDR1, 15)
         self.stakeToHeight(3, fSync=False)
-        txidb1 = nodes[0].sendtoaddress("r8L81gLiWg46j5EGfZSp2JHmA9hBgLbHuf", 15)
+        txidb1 = nodes[0].sendtoaddress(MS1, 15)
         self.stakeToHeight(4, fSync=False)
-        txid2 = nodes[0].sendtoaddress("pqZDE7YNWv5PJWidiaEG8tqfebkd6PNZDV", 20)
+        txid2 = nodes[0].sendtoaddress(ADDR1, 20)
         self.stakeToHeight(5, fSync=False)
-        txidb2 = nodes[0].sendtoaddress("r8L81gLiWg46j5EGfZSp2JHmA9hBgLbHuf", 20)
+        txidb2 = nodes[0].sendtoaddress(MS1, 20)
         self.stakeToHeight(6)
 
-        txids = nodes[1].getaddresstxids("pqZDE7YNWv5PJWidiaEG8tqfebkd6PNZDV")
-        assert_equal(len(txids), 3)
-        assert_equal(txids[0], txid0)
-        assert_equal(txids[1], txid1)
-        assert_equal(txids[2], txid2)
-
-        txidsb = nodes[1].getaddresstxids("r8L81gLiWg46j5EGfZSp2JHmA9hBgLbHuf")
-        assert_equal(len(txidsb), 3)
-        assert_equal(txidsb[0], txidb0)
-        assert_equal(txidsb[1], txidb1)
-        assert_equal(txidsb[2], txidb2)
+        txids, txidsb = batch_results(nodes[1], [
+            nodes[1].getaddresstxids.get_request(ADDR1),
+            nodes[1].getaddresstxids.get_request(MS1),
+        ])
+        assert_equal(txids, [txid0, txid1, txid2])
+        assert_equal(txidsb, [txidb0, txidb1, txidb2])
 
 
         # Check that limiting by height works
         self.log.info("Testing querying txids by range of block heights..")
         # Note start and end parameters must be > 0 to apply
         height_txids = nodes[1].getaddresstxids({
-            "addresses": ["r8L81gLiWg46j5EGfZSp2JHmA9hBgLbHuf"],
+            "addresses": [MS1],
             "start": 3,
             "end": 4
         })
@@ -116,17 +130,11 @@ class AddressIndexTest(ParticlTestFramework):
         assert_equal(height_txids[0], txidb1)
 
         # Check that multiple addresses works
-        multitxids = nodes[1].getaddresstxids({"addresses": ["r8L81gLiWg46j5EGfZSp2JHmA9hBgLbHuf", "pqZDE7YNWv5PJWidiaEG8tqfebkd6PNZDV"]})
-        assert_equal(len(multitxids), 6)
-        assert_equal(multitxids[0], txid0)
-        assert_equal(multitxids[1], txidb0)
-        assert_equal(multitxids[2], txid1)
-        assert_equal(multitxids[3], txidb1)
-        assert_equal(multitxids[4], txid2)
-        assert_equal(multitxids[5], txidb2)
+        multitxids = nodes[1].getaddresstxids({"addresses": [MS1, ADDR1]})
+        assert_equal(multitxids, [txid0, txidb0, txid1, txidb1, txid2, txidb2])
 
         # Check that balances are correct
-        balance0 = nodes[1].getaddressbalance("r8L81gLiWg46j5EGfZSp2JHmA9hBgLbHuf")
+        balance0 = nodes[1].getaddressbalance(MS1)
         assert_equal(balance0["balance"], 45 * 100000000)
 
 
@@ -134,7 +142,7 @@ class AddressIndexTest(ParticlTestFramework):
         self.log.info("Testing for txid uniqueness...")
 
         inputs = []
-        outputs = {'pqZDE7YNWv5PJWidiaEG8tqfebkd6PNZDV':1,'pqavEUgLCZeGh8o9sTcCfYVAsrTgnQTUsK':1}
+        outputs = {ADDR1: 1, ADDR2: 1}
         tx = nodes[0].createrawtransaction(inputs, outputs)
 
         # modified outputs to go to the same address
@@ -146,23 +154,23 @@ class AddressIndexTest(ParticlTestFramework):
 
         self.stakeBlocks(1)
 
-        txidsmany = nodes[1].getaddresstxids("pqavEUgLCZeGh8o9sTcCfYVAsrTgnQTUsK")
+        txidsmany = nodes[1].getaddresstxids(ADDR2)
         assert_equal(len(txidsmany), 1)
         assert_equal(txidsmany[0], sent_txid)
 
 
         # Check that balances are correct
         self.log.info("Testing balances...")
-        balance0 = nodes[1].getaddressbalance("pqavEUgLCZeGh8o9sTcCfYVAsrTgnQTUsK")
+        balance0, balance1 = batch_results(nodes[1], [
+            nodes[1].getaddressbalance.get_request(ADDR2),
+            nodes[1].getaddressbalance.get_request(ADDR1),
+        ])
         assert_equal(balance0["balance"], 2 * 100000000)
-
-
-        balance0 = nodes[1].getaddressbalance("pqZDE7YNWv5PJWidiaEG8tqfebkd6PNZDV")
-        assert_equal(balance0["balance"], 45 * 100000000)
+        assert_equal(balance1["balance"], 45 * 100000000)
 
 
         inputs = []
-        outputs = {'pqavEUgLCZeGh8o9sTcCfYVAsrTgnQTUsK':1}
+        outputs = {ADDR2: 1}
         tx = nodes[2].createrawtransaction(inputs, outputs)
         txfunded = nodes[2].fundrawtransaction(tx)
 
@@ -172,37 +180,34 @@ class AddressIndexTest(ParticlTestFramework):
         self.sync_all()
         self.stakeBlocks(1)
 
-        txidsmany = nodes[1].getaddresstxids("pqavEUgLCZeGh8o9sTcCfYVAsrTgnQTUsK")
+        txidsmany = nodes[1].getaddresstxids(ADDR2)
         assert_equal(len(txidsmany), 2)
         assert_equal(txidsmany[1], sent_txid)
 
 
-        balance0 = nodes[1].getaddressbalance('pqZDE7YNWv5PJWidiaEG8tqfebkd6PNZDV')
+        balance0 = nodes[1].getaddressbalance(ADDR1)
         assert (balance0["balance"] < 45 * 100000000)
 
 
         # Check that deltas are returned correctly
-        deltas = nodes[1].getaddressdeltas({"addresses": ['pqavEUgLCZeGh8o9sTcCfYVAsrTgnQTUsK'], "start": 1, "end": 200})
-        balance3 = 0
-        for delta in deltas:
-            balance3 += delta["satoshis"]
+        deltas = nodes[1].getaddressdeltas({"addresses": [ADDR2], "start": 1, "end": 200})
+        balance3 = sum(map(itemgetter("satoshis"), deltas))
         assert_equal(balance3, 300000000)
-        assert_equal(deltas[0]["address"], 'pqavEUgLCZeGh8o9sTcCfYVAsrTgnQTUsK')
+        assert_equal(deltas[0]["address"], ADDR2)
         #assert_equal(deltas[0]["blockindex"], 1)
 
 
-        address2 = 'pqZDE7YNWv5PJWidiaEG8tqfebkd6PNZDV'
         # Check that entire range will be queried
-        deltasAll = nodes[1].getaddressdeltas({"addresses": [address2]})
+        deltasAll = nodes[1].getaddressdeltas({"addresses": [ADDR1]})
         assert_equal(len(deltasAll), 4)
 
         # Check that deltas can be returned from range of block heights
-        deltas = nodes[1].getaddressdeltas({"addresses": [address2], "start": 3, "end": 3})
+        deltas = nodes[1].getaddressdeltas({"addresses": [ADDR1], "start": 3, "end": 3})
         assert_equal(len(deltas), 1)
 
         # Check that unspent outputs can be queried
         self.log.info("Testing utxos...")
-        utxos = nodes[1].getaddressutxos({"addresses": [address2]})
+        utxos = nodes[1].getaddressutxos({"addresses": [ADDR1]})
         assert_equal(len(utxos), 2)
         assert_equal(utxos[0]["satoshis"], 1500000000)
 
@@ -217,10 +222,13 @@ class AddressIndexTest(ParticlTestFramework):
         self.sync_all()
         assert (nodes[1].getblockcount() == height_before - 1)
 
-        balance4 = nodes[1].getaddressbalance(address2)
+        balance4, txids4, utxos2 = batch_results(nodes[1], [
+            nodes[1].getaddressbalance.get_request(ADDR1),
+            nodes[1].getaddresstxids.get_request(ADDR1),
+            nodes[1].getaddressutxos.get_request({"addresses": [ADDR1]}),
+        ])
         assert_equal(balance4['balance'], 4500000000)
-
-        utxos2 = nodes[1].getaddressutxos({"addresses": [address2]})
+        assert_equal(txids4, [txid0, txid1, txid2])
         assert_equal(len(utxos2), 3)
         assert_equal(utxos2[0]["satoshis"], 1000000000)
 
@@ -229,31 +237,31 @@ class AddressIndexTest(ParticlTestFramework):
 
         self.stakeBlocks(1)
 
-        txidsort1 = nodes[0].sendtoaddress(address2, 50)
+        txidsort1 = nodes[0].sendtoaddress(ADDR1, 50)
         self.stakeBlocks(1)
-        txidsort2 = nodes[0].sendtoaddress(address2, 50)
+        txidsort2 = nodes[0].sendtoaddress(ADDR1, 50)
         self.stakeBlocks(1)
 
-        utxos3 = nodes[1].getaddressutxos({"addresses": [address2]})
-        assert_equal(len(utxos3), 4)
-        assert_equal(utxos3[0]["height"], 3)
-        assert_equal(utxos3[1]["height"], 5)
-        assert_equal(utxos3[2]["height"], 9)
-        assert_equal(utxos3[3]["height"], 10)
-
-        assert (utxos3[2]['txid'] == txidsort1)
-        assert (utxos3[3]['txid'] == txidsort2)
+        utxos3 = nodes[1].getaddressutxos({"addresses": [ADDR1]})
+        assert_equal([u['height'] for u in utxos3], [3, 5, 9, 10])
+        assert_equal([u['txid'] for u in utxos3[2:]], [txidsort1, txidsort2])
 
         # Check mempool indexing
         self.log.info("Testing mempool indexing...")
 
         address3 = nodes[3].getnewaddress()
 
+        # getaddressmempool sorts by entry time in seconds, step the mocktime
+        # so each txn gets a distinct entry time
+        mocktime = int(time.time())
+        nodes[2].setmocktime(mocktime)
         txidsort1 = nodes[2].sendtoaddress(address3, 1)
-        self.wait_for_mempool(nodes[1], txidsort1)
+        nodes[2].setmocktime(mocktime + 1)
         txidsort2 = nodes[2].sendtoaddress(address3, 1)
-        self.wait_for_mempool(nodes[1], txidsort2)
+        nodes[2].setmocktime(mocktime + 2)
         txidsort3 = nodes[2].sendtoaddress(address3, 1)
+        nodes[2].setmocktime(0)
+        assert (self.wait_for_mempool_all(nodes[1], [txidsort1, txidsort2, txidsort3]))
 
         mempool = nodes[2].getaddressmempool({"addresses": [address3]})
         assert_equal(len(mempool), 3)
@@ -294,7 +302,7 @@ class AddressIndexTest(ParticlTestFramework):
         self.log.info("Testing results with chain info...")
 
         deltas_with_info = nodes[1].getaddressdeltas({
-            "addresses": [address2],
+            "addresses": [ADDR1],
             "start": 1,
             "end": 10,
             "chainInfo": True
@@ -306,7 +314,7 @@ class AddressIndexTest(ParticlTestFramework):
         assert_equal(deltas_with_info["end"]["height"], 10)
         assert_equal(deltas_with_info["end"]["hash"], end_block_hash)
 
-        utxos_with_info = nodes[1].getaddressutxos({"addresses": [address2], "chainInfo": True})
+        utxos_with_info = nodes[1].getaddressutxos({"addresses": [ADDR1], "chainInfo": True})
         assert (len(utxos_with_info['utxos']) == 2)
         assert (utxos_with_info['utxos'][0]['height'] == 9)
 
@@ -98,6 +98,14 @@ class ParticlTestFramework(BitcoinTestFramework):
                 continue
         return False
 
+    def wait_for_mempool_all(self, node, txids, timeout=30):
+        txids = set(txids)
+        for i in range(int(timeout / 0.05)):
+            if txids.issubset(node.getrawmempool()):
+                return True
+            time.sleep(0.05)
+        return False
+
     def wait_for_wtx(self, node, txid, nTries=20):
         for i in range(50):
             time.sleep(0.5)
@@ -5,124 +5,74 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 #
 # Download or build previous releases.
-# Needs curl and tar to download a release, or the build dependencies when
+# Needs curl to download a release, or the build dependencies when
 # building a release.
 
 import argparse
-import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from fnmatch import fnmatch
 import os
 from pathlib import Path
-import re
 import shutil
 import subprocess
 import sys
+import tarfile
+import tempfile
 import hashlib
 
-SHA256_SUMS = {
-    "0e2819135366f150d9906e294b61dff58fd1996ebd26c2f8e979d6c0b7a79580": {"tag": "v0.14.3", "tarball": "bitcoin-0.14.3-aarch64-linux-gnu.tar.gz"},
-    "d86fc90824a85c38b25c8488115178d5785dbc975f5ff674f9f5716bc8ad6e65": {"tag": "v0.14.3", "tarball": "bitcoin-0.14.3-arm-linux-gnueabihf.tar.gz"},
-    "1b0a7408c050e3d09a8be8e21e183ef7ee570385dc41216698cc3ab392a484e7": {"tag": "v0.14.3", "tarball": "bitcoin-0.14.3-osx64.tar.gz"},
-    "706e0472dbc933ed2757650d54cbcd780fd3829ebf8f609b32780c7eedebdbc9": {"tag": "v0.14.3", "tarball": "bitcoin-0.14.3-x86_64-linux-gnu.tar.gz"},
-    #
-    "d40f18b4e43c6e6370ef7db9131f584fbb137276ec2e3dba67a4b267f81cb644": {"tag": "v0.15.2", "tarball": "bitcoin-0.15.2-aarch64-linux-gnu.tar.gz"},
-    "54fb877a148a6ad189a1e1ab1ff8b11181e58ff2aaf430da55b3fd46ae549a6b": {"tag": "v0.15.2", "tarball": "bitcoin-0.15.2-arm-linux-gnueabihf.tar.gz"},
-    "87e9340ff3d382d543b2b69112376077f0c8b4f7450d372e83b68f5a1e22b2df": {"tag": "v0.15.2", "tarball": "bitcoin-0.15.2-osx64.tar.gz"},
-    "566be44190fd76daa01f13d428939dadfb8e3daacefc8fa17f433cad28f73bd5": {"tag": "v0.15.2", "tarball": "bitcoin-0.15.2-x86_64-linux-gnu.tar.gz"},
-    #
-    "0768c6c15caffbaca6524824c9563b42c24f70633c681c2744649158aa3fd484": {"tag": "v0.16.3", "tarball": "bitcoin-0.16.3-aarch64-linux-gnu.tar.gz"},
-    "fb2818069854a6ad20ea03b28b55dbd35d8b1f7d453e90b83eace5d0098a2a87": {"tag": "v0.16.3", "tarball": "bitcoin-0.16.3-arm-linux-gnueabihf.tar.gz"},
-    "78c3bff3b619a19aed575961ea43cc9e142959218835cf51aede7f0b764fc25d": {"tag": "v0.16.3", "tarball": "bitcoin-0.16.3-osx64.tar.gz"},
-    "5d422a9d544742bc0df12427383f9c2517433ce7b58cf672b9a9b17c2ef51e4f": {"tag": "v0.16.3", "tarball": "bitcoin-0.16.3-x86_64-linux-gnu.tar.gz"},
-    #
-    "5a6b35d1a348a402f2d2d6ab5aed653a1a1f13bc63aaaf51605e3501b0733b7a": {"tag": "v0.17.2", "tarball": "bitcoin-0.17.2-aarch64-linux-gnu.tar.gz"},
-    "d1913a5d19c8e8da4a67d1bd5205d03c8614dfd2e02bba2fe3087476643a729e": {"tag": "v0.17.2", "tarball": "bitcoin-0.17.2-arm-linux-gnueabihf.tar.gz"},
-    "a783ba20706dbfd5b47fbedf42165fce70fbbc7d78003305d964f6b3da14887f": {"tag": "v0.17.2", "tarball": "bitcoin-0.17.2-osx64.tar.gz"},
-    "943f9362b9f11130177839116f48f809d83478b4c28591d486ee9a7e35179da6": {"tag": "v0.17.2", "tarball": "bitcoin-0.17.2-x86_64-linux-gnu.tar.gz"},
-    #
-    "88f343af72803b851c7da13874cc5525026b0b55e63e1b5e1298390c4688adc6": {"tag": "v0.18.1", "tarball": "bitcoin-0.18.1-aarch64-linux-gnu.tar.gz"},
-    "cc7d483e4b20c5dabd4dcaf304965214cf4934bcc029ca99cbc9af00d3771a1f": {"tag": "v0.18.1", "tarball": "bitcoin-0.18.1-arm-linux-gnueabihf.tar.gz"},
-    "b7bbcee7a7540f711b171d6981f939ca8482005fde22689bc016596d80548bb1": {"tag": "v0.18.1", "tarball": "bitcoin-0.18.1-osx64.tar.gz"},
-    "425ee5ec631ae8da71ebc1c3f5c0269c627cf459379b9b030f047107a28e3ef8": {"tag": "v0.18.1", "tarball": "bitcoin-0.18.1-riscv64-linux-gnu.tar.gz"},
-    "600d1db5e751fa85903e935a01a74f5cc57e1e7473c15fd3e17ed21e202cfe5a": {"tag": "v0.18.1", "tarball": "bitcoin-0.18.1-x86_64-linux-gnu.tar.gz"},
-    #
-    "3a80431717842672df682bdb619e66523b59541483297772a7969413be3502ff": {"tag": "v0.19.1", "tarball": "bitcoin-0.19.1-aarch64-linux-gnu.tar.gz"},
-    "657f28213823d240dd3324d14829702f9ad6f0710f8bdd1c379cb3c447197f48": {"tag": "v0.19.1", "tarball": "bitcoin-0.19.1-arm-linux-gnueabihf.tar.gz"},
-    "1ae1b87de26487075cd2fd22e0d4ead87d969bd55c44f2f1d873ecdc6147ebb3": {"tag": "v0.19.1", "tarball": "bitcoin-0.19.1-osx64.tar.gz"},
-    "aa7a9563b48aa79252c8e7b6a41c07a5441bd9f14c5e4562cc72720ea6cb0ee5": {"tag": "v0.19.1", "tarball": "bitcoin-0.19.1-riscv64-linux-gnu.tar.gz"},
-    "5fcac9416e486d4960e1a946145566350ca670f9aaba99de6542080851122e4c": {"tag": "v0.19.1", "tarball": "bitcoin-0.19.1-x86_64-linux-gnu.tar.gz"},
-    #
-    "60c93e3462c303eb080be7cf623f1a7684b37fd47a018ad3848bc23e13c84e1c": {"tag": "v0.20.1", "tarball": "bitcoin-0.20.1-aarch64-linux-gnu.tar.gz"},
-    "55b577e0fb306fb429d4be6c9316607753e8543e5946b542d75d876a2f08654c": {"tag": "v0.20.1", "tarball": "bitcoin-0.20.1-arm-linux-gnueabihf.tar.gz"},
-    "b9024dde373ea7dad707363e07ec7e265383204127539ae0c234bff3a61da0d1": {"tag": "v0.20.1", "tarball": "bitcoin-0.20.1-osx64.tar.gz"},
-    "fa71cb52ee5e0459cbf5248cdec72df27995840c796f58b304607a1ed4c165af": {"tag": "v0.20.1", "tarball": "bitcoin-0.20.1-riscv64-linux-gnu.tar.gz"},
-    "376194f06596ecfa40331167c39bc70c355f960280bd2a645fdbf18f66527397": {"tag": "v0.20.1", "tarball": "bitcoin-0.20.1-x86_64-linux-gnu.tar.gz"},
+# Checksums of the release tarballs, in sha256sum format
+SHA256_SUMS_FILE = Path(__file__).resolve().parent / 'previous_releases_sums.txt'
 
-    "43416854330914992bbba2d0e9adf2a6fff4130be9af8ae2ef1186e743d9a3fe": {"tag": "v0.21.0", "tarball": "bitcoin-0.21.0-aarch64-linux-gnu.tar.gz"},
-    "f028af308eda45a3c4c90f9332f96b075bf21e3495c945ebce48597151808176": {"tag": "v0.21.0", "tarball": "bitcoin-0.21.0-arm-linux-gnueabihf.tar.gz"},
-    "695fb624fa6423f5da4f443b60763dd1d77488bfe5ef63760904a7b54e91298d": {"tag": "v0.21.0", "tarball": "bitcoin-0.21.0-osx64.tar.gz"},
-    "f8b2adfeae021a672effbc7bd40d5c48d6b94e53b2dd660f787340bf1a52e4e9": {"tag": "v0.21.0", "tarball": "bitcoin-0.21.0-riscv64-linux-gnu.tar.gz"},
-    "da7766775e3f9c98d7a9145429f2be8297c2672fe5b118fd3dc2411fb48e0032": {"tag": "v0.21.0", "tarball": "bitcoin-0.21.0-x86_64-linux-gnu.tar.gz"},
 
-    "ac718fed08570a81b3587587872ad85a25173afa5f9fbbd0c03ba4d1714cfa3e": {"tag": "v22.0", "tarball": "bitcoin-22.0-aarch64-linux-gnu.tar.gz"},
-    "b8713c6c5f03f5258b54e9f436e2ed6d85449aa24c2c9972f91963d413e86311": {"tag": "v22.0", "tarball": "bitcoin-22.0-arm-linux-gnueabihf.tar.gz"},
-    "2744d199c3343b2d94faffdfb2c94d75a630ba27301a70e47b0ad30a7e0155e9": {"tag": "v22.0", "tarball": "bitcoin-22.0-osx64.tar.gz"},
-    "2cca5f99007d060aca9d8c7cbd035dfe2f040dd8200b210ce32cdf858479f70d": {"tag": "v22.0", "tarball": "bitcoin-22.0-powerpc64-linux-gnu.tar.gz"},
-    "91b1e012975c5a363b5b5fcc81b5b7495e86ff703ec8262d4b9afcfec633c30d": {"tag": "v22.0", "tarball": "bitcoin-22.0-powerpc64le-linux-gnu.tar.gz"},
-    "9cc3a62c469fe57e11485fdd32c916f10ce7a2899299855a2e479256ff49ff3c": {"tag": "v22.0", "tarball": "bitcoin-22.0-riscv64-linux-gnu.tar.gz"},
-    "59ebd25dd82a51638b7a6bb914586201e67db67b919b2a1ff08925a7936d1b16": {"tag": "v22.0", "tarball": "bitcoin-22.0-x86_64-linux-gnu.tar.gz"},
+def load_sha256_sums(path) -> dict:
+    sums = {}
+    with open(path, 'r', encoding='utf8') as f:
+        for line in f.read().splitlines():
+            if not line:
+                continue
+            sha256, tarball = line.split()
+            sums[sha256] = {"tag": 'v' + tarball.split('-')[1], "tarball": tarball}
+    return sums
 
-    "06f4c78271a77752ba5990d60d81b1751507f77efda1e5981b4e92fd4d9969fb": {"tag": "v23.0", "tarball": "bitcoin-23.0-aarch64-linux-gnu.tar.gz"},
-    "952c574366aff76f6d6ad1c9ee45a361d64fa04155e973e926dfe7e26f9703a3": {"tag": "v23.0", "tarball": "bitcoin-23.0-arm-linux-gnueabihf.tar.gz"},
-    "7c8bc63731aa872b7b334a8a7d96e33536ad77d49029bad179b09dca32cd77ac": {"tag": "v23.0", "tarball": "bitcoin-23.0-arm64-apple-darwin.tar.gz"},
-    "2caa5898399e415f61d9af80a366a3008e5856efa15aaff74b88acf429674c99": {"tag": "v23.0", "tarball": "bitcoin-23.0-powerpc64-linux-gnu.tar.gz"},
-    "217dd0469d0f4962d22818c368358575f6a0abcba8804807bb75325eb2f28b19": {"tag": "v23.0", "tarball": "bitcoin-23.0-powerpc64le-linux-gnu.tar.gz"},
-    "078f96b1e92895009c798ab827fb3fde5f6719eee886bd0c0e93acab18ea4865": {"tag": "v23.0", "tarball": "bitcoin-23.0-riscv64-linux-gnu.tar.gz"},
-    "c816780583009a9dad426dc0c183c89be9da98906e1e2c7ebae91041c1aaaaf3": {"tag": "v23.0", "tarball": "bitcoin-23.0-x86_64-apple-darwin.tar.gz"},
-    "2cca490c1f2842884a3c5b0606f179f9f937177da4eadd628e3f7fd7e25d26d0": {"tag": "v23.0", "tarball": "bitcoin-23.0-x86_64-linux-gnu.tar.gz"},
-}
 
-PARTICL_SHA256_SUMS = {
-    # Particl
-    "fc649cb46d9f4ea4919bb87be8b685474f95f89ae82996dd1e36f2089b69f90d": {"tag": "v0.18.1.7", "tarball": "particl-0.18.1.7-aarch64-linux-gnu.tar.gz"},
-    "779e57c7e4d680736f972de07276a1037de6c2aa8a2c95c8087c43c56927dc60": {"tag": "v0.18.1.7", "tarball": "particl-0.18.1.7-arm-linux-gnueabihf.tar.gz"},
-    "d5a2ac8dac2b3d262a1684c21b444890837ad51f2b93e2372f54fc51d7fccbcd": {"tag": "v0.18.1.7", "tarball": "particl-0.18.1.7-i686-pc-linux-gnu.tar.gz"},
-    "f85b7ee98dab3fbccc7a2de0d560c6861df05d7fbb11664f1da1a5f24d4dc58a": {"tag": "v0.18.1.7", "tarball": "particl-0.18.1.7-riscv64-linux-gnu.tar.gz"},
-    "e758db39812dd2edf2c4aec215dfce4802c37e3a881d81233d24afff9d61af32": {"tag": "v0.18.1.7", "tarball": "particl-0.18.1.7-x86_64-linux-gnu.tar.gz"},
-    "44c9f60a1f5fc8377cc1cef278a99b401a67ef0ff64429ce1aa21ca71bf73c04": {"tag": "v0.18.1.7", "tarball": "particl-0.18.1.7-osx64.tar.gz"},
+def manifest_digest(sums) -> str:
+    hasher = hashlib.sha256()
+    for sha256 in sorted(sums):
+        hasher.update(sha256.encode())
+        hasher.update(sums[sha256]['tarball'].encode())
+    return hasher.hexdigest()
 
-    "94b0d872dc13e985428d12acf3969fb0ca9e5d0a99454929daf60cb9ef573f31": {"tag": "v0.19.2.20", "tarball": "particl-0.19.2.20-aarch64-linux-gnu.tar.gz"},
-    "78f79e629c96ba909797cfd1d16ec9ac67e05fe29cacce5b03c07b34cb562bf4": {"tag": "v0.19.2.20", "tarball": "particl-0.19.2.20-arm-linux-gnueabihf.tar.gz"},
-    "d4c3f7c2c0e8a767986082edb9df085a235468e354b0add546180aa8df6d4994": {"tag": "v0.19.2.20", "tarball": "particl-0.19.2.20-i686-pc-linux-gnu.tar.gz"},
-    "a8d6c1b4090f24de6b0255a3c34cff54ec339bb132b05a71f1a3424560ee2664": {"tag": "v0.19.2.20", "tarball": "particl-0.19.2.20-riscv64-linux-gnu.tar.gz"},
-    "6ac6fee114cdb1e8914e6d43ae3c5f227542a30772000fe202796eb8710c48cf": {"tag": "v0.19.2.20", "tarball": "particl-0.19.2.20-x86_64-linux-gnu.tar.gz"},
-    "960a69830a22bad28f7251cd014ff2a4f1a6dc049aa93852aa6bdd920fcf6dd3": {"tag": "v0.19.2.20", "tarball": "particl-0.19.2.20-osx64.tar.gz"},
 
-    "56c899c09cb11948c9b81e92ff2599fbcf8cd18b10fd3e708064d37b1b1c4bbd": {"tag": "v0.21.2.9", "tarball": "particl-0.21.2.9-aarch64-linux-gnu.tar.gz"},
-    "731a8c7623974b0581d494e89097e42ddd42a19f5567e32d2c5bedbdd6c9d42c": {"tag": "v0.21.2.9", "tarball": "particl-0.21.2.9-arm-linux-gnueabihf.tar.gz"},
-    "c9eb68dc0557b9ebbee5aec36f54e91855d6adc54e415a975ad2b58669ff1a44": {"tag": "v0.21.2.9", "tarball": "particl-0.21.2.9-osx64.tar.gz"},
-    "ca8dcbd078ac9bc5d358aa0a38f2284b707be926ae87d1eff0ea97e36f0934f4": {"tag": "v0.21.2.9", "tarball": "particl-0.21.2.9-riscv64-linux-gnu.tar.gz"},
-    "137b80d47add5cb1847219d9fa929e7ac9ee4c7f72d1703c6012a7c57802b568": {"tag": "v0.21.2.9", "tarball": "particl-0.21.2.9-x86_64-linux-gnu.tar.gz"},
-}
+# Digest of the manifest, must be updated when releases are added
+EXPECTED_MANIFEST_DIGEST = "05af4c19255becf1299f35a08a6b9f781e9d45698f437d49dc5e6c2df0581cd4"
 
+ALL_SHA256_SUMS = load_sha256_sums(SHA256_SUMS_FILE)
+SHA256_SUMS = {k: v for k, v in ALL_SHA256_SUMS.items() if v['tarball'].startswith('bitcoin-')}
+PARTICL_SHA256_SUMS = {k: v for k, v in ALL_SHA256_SUMS.items() if v['tarball'].startswith('particl-')}
 
-@contextlib.contextmanager
-def pushd(new_dir) -> None:
-    previous_dir = os.getcwd()
-    os.chdir(new_dir)
-    try:
-        yield
-    finally:
-        os.chdir(previous_dir)
+TARBALL_TO_SHA = {v['tarball']: k for k, v in ALL_SHA256_SUMS.items()}
+
+
+class HashingReader:
+    """File-like wrapper which hashes all data read through it."""
+
+    def __init__(self, src):
+        self.src = src
+        self.hasher = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.src.read(size)
+        self.hasher.update(data)
+        return data
 
 
-def download_binary(tag, args) -> int:
-    if Path(tag).is_dir():
+def download_binary(tag, args, target_dir) -> int:
+    tag_dir = Path(target_dir) / tag
+    if tag_dir.is_dir():
         if not args.remove_dir:
             print('Using cached {}'.format(tag))
             return 0
-        shutil.rmtree(tag)
-    Path(tag).mkdir()
+        shutil.rmtree(str(tag_dir))
     #bin_path = 'bin/particl-core-{}'.format(tag[1:])
     #match = re.compile('v(.*)(rc[0-9]+)$').search(tag)
     #if match:
@@ -138,103 +88,130 @@ def download_binary(tag, args) -> int:
     tarballUrl = 'https://github.com/particl/particl-core/releases/download/v{tag}/{tarball}'.format(
          tag=tag[1:], tarball=tarball)
 
-    print('Fetching: {tarballUrl}'.format(tarballUrl=tarballUrl))
-
-    header, status = subprocess.Popen(
-        ['curl', '--head', tarballUrl], stdout=subprocess.PIPE).communicate()
-    if re.search("404 Not Found", header.decode("utf-8")):
-        print("Binary tag was not found")
+    expected = TARBALL_TO_SHA.get(tarball)
+    if expected is None:
+        print("{}: Checksum for given version doesn't exist".format(tag))
         return 1
 
-    curlCmds = [
-        ['curl', '-L', '--remote-name', tarballUrl]
-    ]
+    print('Fetching: {tarballUrl}'.format(tarballUrl=tarballUrl))
 
-    for cmd in curlCmds:
-        ret = subprocess.run(cmd).returncode
+    # Extract the tarball into a temporary directory while it is being
+    # downloaded, hashing the compressed stream on the way. The directory
+    # is only moved into place once the checksum has been verified.
+    prefix = 'particl-{tag}/'.format(tag=tag[1:])
+    extract_args = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+    tmp_dir = Path(tempfile.mkdtemp(prefix='.{}-'.format(tag), dir=str(target_dir)))
+    curl = subprocess.Popen(
+        ['curl', '-L', '--fail', '--silent', '--show-error',
+         '--retry', '3', '--retry-delay', '2', tarballUrl],
+        stdout=subprocess.PIPE)
+    try:
+        reader = HashingReader(curl.stdout)
+        try:
+            with tarfile.open(fileobj=reader, mode='r|gz') as tf:
+                for member in tf:
+                    # Same as tar --strip-components=1 particl-<version>
+                    if not member.name.startswith(prefix):
+                        continue
+                    member.name = member.name[len(prefix):]
+                    if not member.name or member.name.startswith('/') or '..' in Path(member.name).parts:
+                        continue
+                    # Skip devices, FIFOs and other special files
+                    if not (member.isreg() or member.isdir() or member.issym() or member.islnk()):
+                        continue
+                    if member.islnk():
+                        if not member.linkname.startswith(prefix):
+                            continue
+                        member.linkname = member.linkname[len(prefix):]
+                    if member.issym() or member.islnk():
+                        # Links must not point outside the release directory
+                        if member.linkname.startswith('/') or '..' in Path(member.linkname).parts:
+                            continue
+                    tf.extract(member, path=str(tmp_dir), **extract_args)
+            invalid_tarball = False
+        except (tarfile.TarError, EOFError):
+            invalid_tarball = True
+        # Read the rest of the stream, so curl can finish and report its own
+        # errors, and any trailing padding not consumed by tarfile is hashed
+        while reader.read(1 << 20):
+            pass
+        curl.stdout.close()
+        # --fail makes curl exit non-zero on HTTP errors such as 404
+        ret = curl.wait()
         if ret:
+            print("{}: Binary tag was not found or download failed".format(tag))
             return ret
-
-    hasher = hashlib.sha256()
-    with open(tarball, "rb") as afile:
-        hasher.update(afile.read())
-    tarballHash = hasher.hexdigest()
-
-    BOTH_SHA256_SUMS = {**SHA256_SUMS, **PARTICL_SHA256_SUMS}
-    if tarballHash not in BOTH_SHA256_SUMS or BOTH_SHA256_SUMS[tarballHash]['tarball'] != tarball:
-        if tarball in BOTH_SHA256_SUMS.values():
-            print("Checksum did not match")
+        if invalid_tarball:
+            print("{}: Invalid tarball".format(tag))
             return 1
 
-        print("Checksum for given version doesn't exist")
-        return 1
-    print("Checksum matched")
+        if expected != reader.hasher.hexdigest():
+            print("{}: Checksum did not match".format(tag))
+            return 1
+        print("{}: Checksum matched".format(tag))
 
-    # Extract tarball
-    ret = subprocess.run(['tar', '-zxf', tarball, '-C', tag,
-                          '--strip-components=1',
-                          'particl-{tag}'.format(tag=tag[1:])]).returncode
-    if ret:
-        return ret
+        # mkdtemp creates the directory with mode 0700
+        tmp_dir.chmod(0o755)
+        os.rename(str(tmp_dir), str(tag_dir))
+    finally:
+        if curl.poll() is None:
+            curl.kill()
+            curl.wait()
+        if tmp_dir.is_dir():
+            shutil.rmtree(str(tmp_dir))
 
-    Path(tarball).unlink()
     return 0
 
 
-def build_release(tag, args) -> int:
+def build_release(tag, args, target_dir) -> int:
     githubUrl = "https://github.com/particl/particl-core"
+    target_dir = Path(target_dir).resolve()
+    target = target_dir / tag
     if args.remove_dir:
-        if Path(tag).is_dir():
-            shutil.rmtree(tag)
-    if not Path(tag).is_dir():
+        if target.is_dir():
+            shutil.rmtree(target)
+    if not target.is_dir():
         # fetch new tags
         subprocess.run(
-            ["git", "fetch", githubUrl, "--tags"])
-        output = subprocess.check_output(['git', 'tag', '-l', tag])
+            ["git", "fetch", githubUrl, "--tags"], cwd=str(target_dir))
+        output = subprocess.check_output(['git', 'tag', '-l', tag], cwd=str(target_dir))
         if not output:
             print('Tag {} not found'.format(tag))
             return 1
     ret = subprocess.run([
         'git', 'clone', githubUrl, tag
-    ]).returncode
+    ], cwd=str(target_dir)).returncode
+    if ret:
+        return ret
+    ret = subprocess.run(['git', 'checkout', tag], cwd=str(target)).returncode
     if ret:
         return ret
-    with pushd(tag):
-        ret = subprocess.run(['git', 'checkout', tag]).returncode
+    cores = os.cpu_count() or 4
+    if args.depends:
+        ret = subprocess.run(['make', 'NO_QT=1', '-j{}'.format(cores)],
+                             cwd=str(target / 'depends')).returncode
         if ret:
             return ret
-        host = args.host
-        if args.depends:
-            with pushd('depends'):
-                ret = subprocess.run(['make', 'NO_QT=1']).returncode
-                if ret:
-                    return ret
-                host = os.environ.get(
-                    'HOST', subprocess.check_output(['./config.guess']))
-        config_flags = '--prefix={pwd}/depends/{host} '.format(
-            pwd=os.getcwd(),
-            host=host) + args.config_flags
-        cmds = [
-            './autogen.sh',
-            './configure {}'.format(config_flags),
-            'make',
-        ]
-        for cmd in cmds:
-            ret = subprocess.run(cmd.split()).returncode
-            if ret:
-                return ret
-        # Move binaries, so they're in the same place as in the
-        # release download
-        Path('bin').mkdir(exist_ok=True)
-        files = ['particld', 'particl-cli', 'particl-tx']
-        for f in files:
-            Path('src/'+f).rename('bin/'+f)
+    # args.host was resolved from HOST or config.guess once in check_host
+    config_flags = '--prefix={pwd}/depends/{host} '.format(
+        pwd=target,
+        host=args.host) + args.config_flags
+    ret = subprocess.run(['bash', '-c', './autogen.sh && ./configure {} && make -j{}'.format(
+        config_flags, cores)], cwd=str(target)).returncode
+    if ret:
+        return ret
+    # Move binaries, so they're in the same place as in the
+    # release download
+    (target / 'bin').mkdir(exist_ok=True)
+    files = ['particld', 'particl-cli', 'particl-tx']
+    for f in files:
+        (target / 'src' / f).rename(target / 'bin' / f)
     return 0
 
 
 def check_host(args) -> int:
     args.host = os.environ.get('HOST', subprocess.check_output(
-        './depends/config.guess').decode())
+        './depends/config.guess').decode().strip())
     if args.download_binary:
         platforms = {
             'aarch64-*-linux*': 'aarch64-linux-gnu',
@@ -253,25 +230,31 @@ def check_host(args) -> int:
 
 
 def main(args) -> int:
+    if manifest_digest(ALL_SHA256_SUMS) != EXPECTED_MANIFEST_DIGEST:
+        print('Unexpected contents in {}'.format(SHA256_SUMS_FILE))
+        return 1
     Path(args.target_dir).mkdir(exist_ok=True, parents=True)
     print("Releases directory: {}".format(args.target_dir))
     ret = check_host(args)
     if ret:
         return ret
     if args.download_binary:
-        with pushd(args.target_dir):
-            for tag in args.tags:
-                ret = download_binary(tag, args)
-                if ret:
-                    return ret
-        return 0
+        # Downloads are I/O bound, fetch all tags concurrently. Each tag
+        # must be submitted only once, workers share the tag directory.
+        tags = list(dict.fromkeys(args.tags))
+        ret = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(tags)))) as executor:
+            futures = [executor.submit(download_binary, tag, args, args.target_dir)
+                       for tag in tags]
+            for future in as_completed(futures):
+                ret = ret or future.result()
+        return ret
     args.config_flags = os.environ.get('CONFIG_FLAGS', '')
     args.config_flags += ' --without-gui --disable-tests --disable-bench'
-    with pushd(args.target_dir):
-        for tag in args.tags:
-            ret = build_release(tag, args)
-            if ret:
-                return ret
+    for tag in args.tags:
+        ret = build_release(tag, args, args.target_dir)
+        if ret:
+            return ret
     return 0
 
 